@@ -1,35 +1,45 @@
 """FastAPI HTTP server with rate limiting and validation."""
 
 import logging
+import os
 from collections.abc import AsyncIterator
-from contextlib import asynccontextmanager
+from contextlib import aclosing, asynccontextmanager
 
 from dotenv import load_dotenv
-from fastapi import Depends, FastAPI, HTTPException, Request
+from fastapi import Depends, FastAPI, Request
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from slowapi import Limiter
 from slowapi.errors import RateLimitExceeded
 from slowapi.util import get_remote_address
-from starlette.responses import JSONResponse
 
 from agent import CodeLocatorAgent
-from metadata import CodeExplanation
-from utils import validate_query
+from metadata import CodeExplanation, QueryRequest
 
 load_dotenv()
 logger = logging.getLogger(__name__)
 
+# Moving window avoids the double burst fixed windows allow at their edges.
+# Point RATE_LIMIT_STORAGE at a shared backend (e.g. redis://host:6379) so the
+# limit holds across multiple workers or instances.
 limiter = Limiter(
-    key_func=get_remote_address, strategy="fixed-window", storage_uri="memory://"
+    key_func=get_remote_address,
+    strategy="moving-window",
+    storage_uri=os.getenv("RATE_LIMIT_STORAGE", "memory://"),
 )
 
+# One budget per client across /query and /query/stream
+QUERY_RATE_LIMIT = "10/minute"
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI) -> AsyncIterator[None]:
     """Manage application lifecycle and resources."""
     logger.info("Initializing CodeLocatorAgent...")
     app.state.agent_instance = CodeLocatorAgent()
+    app.state.agent_instance.start()
     logger.info("Application startup complete")
     yield
+    await app.state.agent_instance.close()
     logger.info("Application shutdown complete")
 
 
@@ -42,42 +52,73 @@ app = FastAPI(
     title="Code Locator Agent API",
     description="Query httpx codebase with AI agent.",
     lifespan=lifespan,
+    default_response_class=ORJSONResponse,
 )
 
 app.state.limiter = limiter
 
 
 @app.exception_handler(RateLimitExceeded)
-async def rate_limit_handler(request: Request, exc: RateLimitExceeded) -> JSONResponse:
+async def rate_limit_handler(
+    request: Request, exc: RateLimitExceeded
+) -> ORJSONResponse:
     """Handle rate limit exceeded errors."""
     logger.warning(f"Rate limit exceeded from {get_remote_address(request)}")
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=429, content={"error": f"Rate limit exceeded: {exc.detail}"}
     )
 
 
 @app.post("/query", response_model=CodeExplanation)
-@limiter.limit("10/minute")
+@limiter.shared_limit(QUERY_RATE_LIMIT, scope="query")
 async def query_endpoint(
     request: Request,
+    payload: QueryRequest,
     agent: CodeLocatorAgent = Depends(get_agent),
 ) -> CodeExplanation:
     """Process code explanation query.
 
     Args:
         request: HTTP request object
+        payload: Validated request body
         agent: Injected agent instance
 
     Returns:
         CodeExplanation with symbols, locations, and explanation
     """
-    body = await request.body()
-    text_query = body.decode("utf-8").strip()
+    response = await agent.run_query(payload.query)
 
-    if not text_query:
-        raise HTTPException(400, "Empty query")
+    return response
 
-    validated_query = validate_query(text_query)
-    response = await agent.run_query(validated_query)
 
-    return response
+@app.post("/query/stream")
+@limiter.shared_limit(QUERY_RATE_LIMIT, scope="query")
+async def query_stream_endpoint(
+    request: Request,
+    payload: QueryRequest,
+    agent: CodeLocatorAgent = Depends(get_agent),
+) -> StreamingResponse:
+    """Stream a code explanation as server-sent events.
+
+    Each event carries the CodeExplanation generated so far as JSON; the last
+    event is the complete explanation. The run is cancelled if the client
+    disconnects.
+
+    Args:
+        request: HTTP request object
+        payload: Validated request body
+        agent: Injected agent instance
+
+    Returns:
+        StreamingResponse emitting text/event-stream events
+    """
+    async def events() -> AsyncIterator[str]:
+        # aclosing ends the agent run as soon as we stop reading from it
+        async with aclosing(agent.stream_query(payload.query)) as outputs:
+            async for output in outputs:
+                if await request.is_disconnected():
+                    logger.info("Client disconnected, cancelling stream")
+                    break
+                yield f"data: {output.model_dump_json()}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
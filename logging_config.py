@@ -0,0 +1,63 @@
+"""Process-wide logging setup shared by the launcher and the ASGI app."""
+
+import atexit
+import logging
+import os
+import queue
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+LOG_FILE = "app.log"
+
+_configured = False
+
+
+def setup_logging() -> None:
+    """Route all logging through a background QueueListener.
+
+    Records are queued and written by a background thread, so file writes
+    and rotation never block the event loop. With several workers only the
+    console is used: processes rotating one shared file clobber each other's
+    records. Safe to call more than once per process.
+    """
+    global _configured
+    if _configured:
+        return
+    _configured = True
+
+    handlers: list[logging.Handler] = [logging.StreamHandler()]  # Console output
+    if int(os.getenv("WORKERS", "1")) <= 1:
+        handlers.append(
+            RotatingFileHandler(
+                LOG_FILE,
+                maxBytes=10 * 1024 * 1024,  # 10MB
+                backupCount=5,
+                encoding="utf-8",
+            )
+        )
+
+    formatter = logging.Formatter(
+        "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    )
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue: queue.Queue[logging.LogRecord] = queue.Queue(-1)
+    log_listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    log_listener.start()
+    atexit.register(log_listener.stop)
+
+    # force: importing the MCP server has already installed its own root
+    # handler. The queue handler only merges args into the message; the
+    # listener's handlers apply the real format.
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(message)s",
+        handlers=[QueueHandler(log_queue)],
+        force=True,
+    )
+
+    # Reduce verbosity of noisy loggers
+    logging.getLogger("httpcore").setLevel(logging.WARNING)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    logging.getLogger("mcp.client.sse").setLevel(logging.WARNING)
+    logging.getLogger("mcp.server.sse").setLevel(logging.WARNING)
@@ -1,8 +1,20 @@
 """Code symbol lookup builder for httpx library."""
 
 import ast
+import functools
+import hashlib
+import importlib.util
+import io
 import logging
+import mmap
+import multiprocessing
 import os
+import pickle
+import stat
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
 from pathlib import Path
 
 from metadata import SymbolMetadata
@@ -11,17 +23,108 @@ HTTPX_DIR = os.getenv(
     "HTTPX_SOURCE_DIR", str(Path(__file__).parent / "httpx" / "httpx")
 )
 
+# Per-user by default: the cache is unpickled, so it must not live anywhere
+# other users can write to
+LOOKUP_CACHE_DIR = os.getenv("LOOKUP_CACHE_DIR") or str(
+    Path(os.getenv("XDG_CACHE_HOME") or Path.home() / ".cache") / "repo-analyst"
+)
+
+# Bump whenever the pickled index layout changes
+CACHE_VERSION = 6
+
+QUERY_CACHE_SIZE = 1024
+
+# Below this many files, worker startup and pickling ASTs back costs more
+# than parsing serially (httpx itself is only a few dozen files)
+PARALLEL_PARSE_MIN_FILES = 64
+
 logger = logging.getLogger(__name__)
 
 
+@dataclass(slots=True, frozen=True)
+class SymbolEntry:
+    """Lookup table entry for a code symbol (class, function, or method).
+
+    A slotted dataclass rather than a Pydantic model, since thousands are
+    created at build time and kept for the life of the process. Convert
+    with to_metadata() when the entry leaves the process.
+    """
+
+    type: str
+    name: str
+    parent_class: str | None
+    docstring: str | None
+    start_line: int
+    end_line: int
+    file_path: str
+    module_name: str
+    # Byte range of the symbol's code in the builder's source blob
+    source_offset: int
+    source_length: int
+
+    def to_metadata(self) -> SymbolMetadata:
+        """Convert to the SymbolMetadata model used in API responses."""
+        return SymbolMetadata.model_validate(self, from_attributes=True)
+
+
+def _parse_file(file_path: Path) -> tuple[list[str], ast.AST] | Exception:
+    """Parse a Python file, returning the error instead of raising.
+
+    Defined at module level so it can run in a worker process.
+
+    Args:
+        file_path: Path to the Python file
+
+    Returns:
+        (source_lines, ast_tree), or the exception raised while reading or parsing
+    """
+    try:
+        # Decodes once, honouring any PEP 263 coding cookie, and normalizes
+        # newlines to "\n" so that lines split the same way ast numbers them
+        source = importlib.util.decode_source(file_path.read_bytes())
+        tree = ast.parse(source, filename=str(file_path))
+        return io.StringIO(source).readlines(), tree
+    except Exception as e:
+        return e
+
+
+def _find_python_files(root_dir: Path) -> list[Path]:
+    """Recursively collect .py files under a directory.
+
+    Uses os.scandir, whose entries carry the file type from the directory
+    listing, so no extra stat call is needed per entry. Symlinked
+    directories are not followed, matching Path.rglob.
+
+    Args:
+        root_dir: Directory to search
+
+    Returns:
+        Paths of all Python files found
+    """
+    py_files: list[Path] = []
+    pending = [str(root_dir)]
+    while pending:
+        with os.scandir(pending.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    pending.append(entry.path)
+                elif entry.name.endswith(".py") and entry.is_file():
+                    py_files.append(Path(entry.path))
+    return py_files
+
+
 class LookupBuilder:
     """Build and query symbol lookup table from Python source files."""
 
-    def __init__(self, httpx_dir: str | None = None) -> None:
+    def __init__(
+        self, httpx_dir: str | None = None, cache_dir: str | None = None
+    ) -> None:
         """Initialize lookup builder.
 
         Args:
             httpx_dir: Path to httpx source directory
+            cache_dir: Directory for the on-disk lookup table cache; each
+                source root is cached in its own subdirectory
 
         Raises:
             ValueError: If directory doesn't exist
@@ -34,79 +137,329 @@ class LookupBuilder:
         if not self.root_dir.exists():
             raise ValueError(f"httpx directory not found: {self.root_dir}")
 
-        self.lookup_table: dict[str, list[SymbolMetadata]] = {}
-        logger.debug(f"Initialized with root_dir: {self.root_dir}")
+        # Pruning only ever looks inside this root's subdirectory, so servers
+        # indexing different trees can share LOOKUP_CACHE_DIR
+        root_key = hashlib.sha256(str(self.root_dir.resolve()).encode()).hexdigest()
+        self.cache_dir = Path(cache_dir or LOOKUP_CACHE_DIR) / root_key[:16]
+        self.lookup_table: dict[str, list[SymbolEntry]] = {}
+        # Every proper dotted suffix of each key ("Client.get", "get", ...)
+        self.suffix_index: dict[str, list[SymbolEntry]] = {}
+        # UTF-8 source of every indexed file, memory-mapped from the cache when
+        # possible so worker processes share a single copy via the page cache
+        self._source: mmap.mmap | bytes = b""
+        self._cached_query = functools.lru_cache(maxsize=QUERY_CACHE_SIZE)(
+            self._query_symbols
+        )
+        logger.debug("Initialized with root_dir: %s", self.root_dir)
 
     def build(self) -> None:
         """Build lookup table from source files.
 
         The lookup table is stored in self.lookup_table and can be accessed directly.
+        A pickled copy is kept in the cache directory and reused as long as
+        no source file has been added, removed, or modified. Symbol code lives
+        in a separate source blob next to it, which is memory-mapped.
         """
-        results = self._read_file_content()
+        logger.debug("Scanning directory: %s", self.root_dir)
+        py_files = _find_python_files(self.root_dir)
+        logger.info(f"Found {len(py_files)} Python files")
+
+        cache_path = self.cache_dir / f"{self._cache_key(py_files)}.pkl"
+        self._cached_query.cache_clear()
+        use_cache = self._prepare_cache_dir()
+
+        if use_cache and self._load_cache(cache_path):
+            logger.info(
+                f"Loaded lookup table with {len(self.lookup_table)} keys from cache"
+            )
+            return
+
+        results = self._read_file_content(py_files)
         self._extract_metadata_from_trees(results)
+        if use_cache:
+            self._save_cache(cache_path)
         logger.info(f"Built lookup table with {len(self.lookup_table)} keys")
 
-    def _read_file_content(self) -> list[tuple[Path, Path, ast.AST]]:
-        """Parse Python files into AST trees.
+    def _cache_key(self, py_files: list[Path]) -> str:
+        """Fingerprint the source tree from file paths, sizes, and mtimes.
+
+        Args:
+            py_files: Python files in the source tree
 
         Returns:
-            List of (absolute_path, relative_path, ast_tree) tuples
+            Hex digest identifying this version of the tree
         """
-        logger.debug(f"Scanning directory: {self.root_dir}")
-        py_files = list(self.root_dir.rglob("*.py"))
-        logger.info(f"Found {len(py_files)} Python files")
+        digest = hashlib.sha256(f"{CACHE_VERSION}:{self.root_dir.resolve()}".encode())
+        for file_path in sorted(py_files):
+            file_stat = file_path.stat()
+            digest.update(
+                f"{file_path}:{file_stat.st_size}:{file_stat.st_mtime_ns}\n".encode()
+            )
+        return digest.hexdigest()
+
+    def _prepare_cache_dir(self) -> bool:
+        """Create the cache directory and check that it can be trusted.
 
-        results: list[tuple[Path, Path, ast.AST]] = []
-        for file_path in py_files:
+        Loading the cache unpickles it, which can run arbitrary code, so both
+        the shared cache directory and this root's subdirectory must be owned
+        by the current user and not writable by anyone else.
+
+        Returns:
+            True if the cache directory may be used, False otherwise
+        """
+        for directory in (self.cache_dir.parent, self.cache_dir):
+            try:
+                directory.mkdir(mode=0o700, parents=True, exist_ok=True)
+                dir_stat = directory.stat()
+            except OSError as e:
+                logger.warning(f"Lookup table cache disabled, {directory}: {e}")
+                return False
+
+            # Ownership and permission bits are only meaningful on POSIX
+            if not hasattr(os, "getuid"):
+                continue
+
+            if dir_stat.st_uid != os.getuid() or dir_stat.st_mode & (
+                stat.S_IWGRP | stat.S_IWOTH
+            ):
+                logger.warning(
+                    f"Lookup table cache disabled: {directory} is not owned by "
+                    "the current user or is writable by others"
+                )
+                return False
+
+        return True
+
+    def _load_cache(self, cache_path: Path) -> bool:
+        """Load the lookup table from a cache file, if present and readable.
+
+        Args:
+            cache_path: Cache file for the current source tree
+
+        Returns:
+            True if the lookup table was loaded, False otherwise
+        """
+        if not cache_path.exists():
+            return False
+
+        try:
+            with cache_path.open("rb") as f:
+                self.lookup_table, self.suffix_index = pickle.load(f)
+            self._source = self._map_source(cache_path.with_suffix(".src"))
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable cache {cache_path}: {e}")
+            self.lookup_table, self.suffix_index = {}, {}
+            return False
+
+        return True
+
+    def _save_cache(self, cache_path: Path) -> None:
+        """Write the lookup table to a cache file.
+
+        Files are written under a temporary name and renamed into place, so
+        concurrent readers never see a partial file. The source blob goes
+        first, since readers only look for it once the index exists. It is
+        then mapped in place of the in-memory copy, and caches left by older
+        versions of the source tree are deleted.
+
+        Args:
+            cache_path: Cache file for the current source tree
+        """
+        source_path = cache_path.with_suffix(".src")
+        tmp_path = cache_path.with_suffix(f".{os.getpid()}.tmp")
+        try:
+            tmp_path.write_bytes(self._source)
+            os.replace(tmp_path, source_path)
+
+            with tmp_path.open("wb") as f:
+                pickle.dump(
+                    (self.lookup_table, self.suffix_index),
+                    f,
+                    protocol=pickle.HIGHEST_PROTOCOL,
+                )
+            os.replace(tmp_path, cache_path)
+            logger.debug("Saved lookup table cache to %s", cache_path)
+
+            self._source = self._map_source(source_path)
+        except OSError as e:
+            logger.warning(f"Could not write cache {cache_path}: {e}")
+            tmp_path.unlink(missing_ok=True)
+            return
+
+        self._remove_stale_cache(cache_path)
+
+    def _remove_stale_cache(self, cache_path: Path) -> None:
+        """Delete cache files that belong to other versions of this source tree.
+
+        Only this root's subdirectory is scanned. Temporary files for the
+        current tree are kept, since another worker may still be writing them.
+
+        Args:
+            cache_path: Cache file for the current source tree
+        """
+        key = cache_path.stem
+        try:
+            entries = list(self.cache_dir.iterdir())
+        except OSError as e:
+            logger.debug("Could not list %s: %s", self.cache_dir, e)
+            return
+
+        for entry in entries:
+            if entry.name.startswith(key) or entry.suffix not in (
+                ".pkl",
+                ".src",
+                ".tmp",
+            ):
+                continue
             try:
-                with file_path.open(encoding="utf-8") as f:
-                    source = f.read()
-                tree = ast.parse(source, filename=str(file_path))
-                relative_path = file_path.relative_to(self.root_dir)
-                results.append((file_path, relative_path, tree))
-            except SyntaxError as e:
-                logger.warning(f"Syntax error in {file_path}: {e}")
+                entry.unlink()
+                logger.debug("Removed stale cache file %s", entry)
+            except OSError as e:
+                logger.debug("Could not remove %s: %s", entry, e)
+
+    def _map_source(self, source_path: Path) -> mmap.mmap | bytes:
+        """Map a source blob read-only.
+
+        Args:
+            source_path: Source blob written by _save_cache
+
+        Returns:
+            Read-only memory map of the file (bytes if it is empty)
+        """
+        with source_path.open("rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return b""
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _read_file_content(
+        self, py_files: list[Path]
+    ) -> list[tuple[Path, Path, ast.AST, list[str]]]:
+        """Parse Python files into AST trees.
+
+        Args:
+            py_files: Python files to parse
+
+        Returns:
+            List of (absolute_path, relative_path, ast_tree, source_lines) tuples
+        """
+        results: list[tuple[Path, Path, ast.AST, list[str]]] = []
+        for file_path, parsed in zip(py_files, self._parse_files(py_files)):
+            if isinstance(parsed, SyntaxError):
+                logger.warning(f"Syntax error in {file_path}: {parsed}")
                 continue
-            except Exception as e:
-                logger.warning(f"Error reading {file_path}: {e}")
+            if isinstance(parsed, Exception):
+                logger.warning(f"Error reading {file_path}: {parsed}")
                 continue
+            lines, tree = parsed
+            relative_path = file_path.relative_to(self.root_dir)
+            results.append((file_path, relative_path, tree, lines))
 
         return results
 
+    def _parse_files(
+        self, py_files: list[Path]
+    ) -> list[tuple[list[str], ast.AST] | Exception]:
+        """Parse files, across worker processes for large trees.
+
+        Workers are forked so they do not re-import the application entry
+        point; where fork is unavailable, files are parsed serially.
+
+        Args:
+            py_files: Python files to parse
+
+        Returns:
+            (source_lines, ast_tree) or exception for each file, in the same order
+        """
+        if (
+            len(py_files) >= PARALLEL_PARSE_MIN_FILES
+            and (os.cpu_count() or 1) > 1
+            and "fork" in multiprocessing.get_all_start_methods()
+        ):
+            logger.debug("Parsing %d files in worker processes", len(py_files))
+            with ProcessPoolExecutor(
+                mp_context=multiprocessing.get_context("fork")
+            ) as executor:
+                return list(executor.map(_parse_file, py_files, chunksize=16))
+
+        return [_parse_file(file_path) for file_path in py_files]
+
     def _extract_metadata_from_trees(
-        self, results: list[tuple[Path, Path, ast.AST]]
+        self, results: list[tuple[Path, Path, ast.AST, list[str]]]
     ) -> None:
         """Extract symbol metadata from AST trees.
 
+        Every class and function defined at module or class scope is indexed,
+        including ones inside if/try blocks and classes nested in classes, and
+        keyed by its qualified name. Functions in a class body are recorded
+        as methods of that class. Definitions local to a function body are
+        not importable by that name and are skipped. The source of each file
+        is appended to the source blob.
+
         Args:
-            results: List of (absolute_path, relative_path, ast_tree) tuples
+            results: List of (absolute_path, relative_path, ast_tree, source_lines)
+                tuples
         """
-        for absolute_path, relative_path, tree in results:
-            for node in tree.body:
-                match node:
-                    case ast.ClassDef():
-                        self._add_metadata(node, "class", absolute_path, relative_path)
-                        for item in node.body:
-                            match item:
-                                case ast.FunctionDef() | ast.AsyncFunctionDef():
-                                    self._add_metadata(
-                                        item,
-                                        "method",
-                                        absolute_path,
-                                        relative_path,
-                                        parent_class=node.name,
-                                    )
-                    case ast.FunctionDef() | ast.AsyncFunctionDef():
+        source = bytearray()
+        for absolute_path, relative_path, tree, lines in results:
+            # One shared string per file rather than a copy per symbol
+            file_path = sys.intern(str(absolute_path))
+            module_name = sys.intern(self._get_module_name(relative_path))
+
+            # Blob offset of the start of each line, plus the end of the file
+            line_offsets = [len(source)]
+            for line in lines:
+                source += line.encode("utf-8")
+                line_offsets.append(len(source))
+
+            # Breadth-first like ast.walk, carrying the qualified name of the
+            # enclosing class ("" at module scope)
+            pending: deque[tuple[ast.AST, str]] = deque([(tree, "")])
+            while pending:
+                node, enclosing_class = pending.popleft()
+                for child in ast.iter_child_nodes(node):
+                    if not isinstance(
+                        child, (ast.ClassDef, ast.FunctionDef, ast.AsyncFunctionDef)
+                    ):
+                        pending.append((child, enclosing_class))
+                        continue
+
+                    qualname = (
+                        f"{enclosing_class}.{child.name}"
+                        if enclosing_class
+                        else child.name
+                    )
+                    if isinstance(child, ast.ClassDef):
                         self._add_metadata(
-                            node, "function", absolute_path, relative_path
+                            child,
+                            "class",
+                            file_path,
+                            module_name,
+                            line_offsets,
+                            qualname,
                         )
+                        pending.append((child, qualname))
+                    else:
+                        # Not descended into: anything nested is function-local
+                        self._add_metadata(
+                            child,
+                            "method" if enclosing_class else "function",
+                            file_path,
+                            module_name,
+                            line_offsets,
+                            qualname,
+                            parent_class=enclosing_class or None,
+                        )
+
+        self._source = bytes(source)
 
     def _add_metadata(
         self,
         node: ast.FunctionDef | ast.AsyncFunctionDef | ast.ClassDef,
         node_type: str,
-        absolute_path: Path,
-        relative_path: Path,
+        file_path: str,
+        module_name: str,
+        line_offsets: list[int],
+        qualname: str,
         parent_class: str | None = None,
     ) -> None:
         """Add symbol metadata to lookup table.
@@ -114,99 +467,89 @@ class LookupBuilder:
         Args:
             node: AST node (function, method, or class)
             node_type: Type string ('class', 'function', or 'method')
-            absolute_path: Full file path
-            relative_path: Path relative to source root
-            parent_class: Parent class name for methods
+            file_path: Absolute file path
+            module_name: Dotted module name relative to source root
+            line_offsets: Source blob offset of each line of the file
+            qualname: Dotted name within the module (e.g. "Client.get")
+            parent_class: Qualified name of the parent class for methods
         """
-        metadata = SymbolMetadata(
+        metadata = SymbolEntry(
             type=node_type,
             name=node.name,
             parent_class=parent_class,
             docstring=ast.get_docstring(node),
             start_line=node.lineno,
             end_line=node.end_lineno,
-            file_path=str(absolute_path),  # Store ABSOLUTE path for reading
-            module_name=self._get_module_name(relative_path),
+            file_path=file_path,  # Store ABSOLUTE path for reading
+            module_name=module_name,
+            source_offset=line_offsets[node.lineno - 1],
+            source_length=line_offsets[node.end_lineno] - line_offsets[node.lineno - 1],
         )
 
-        key = (
-            f"{metadata.module_name}.{parent_class}.{node.name}"
-            if parent_class
-            else f"{metadata.module_name}.{node.name}"
-        )
+        key = f"{module_name}.{qualname}"
         self.lookup_table.setdefault(key, []).append(metadata)
 
+        parts = key.split(".")
+        for i in range(1, len(parts)):
+            self.suffix_index.setdefault(".".join(parts[i:]), []).append(metadata)
+
     def _get_module_name(self, file_path: Path) -> str:
         """Convert file path to module name."""
         return ".".join(file_path.with_suffix("").parts)
 
-    def query_symbols(self, symbols: list[str]) -> list[SymbolMetadata]:
+    def query_symbols(self, symbols: list[str]) -> list[SymbolEntry]:
         """Query lookup table for symbols.
 
+        Results are memoized per symbol list, since the agent tends to ask
+        for the same names repeatedly.
+
         Args:
             symbols: List of symbol names to find
 
         Returns:
             List of matching symbol metadata
         """
-        logger.debug(f"Querying symbols: {symbols}")
-        all_results = []
+        return list(self._cached_query(tuple(symbols)))
+
+    def _query_symbols(self, symbols: tuple[str, ...]) -> tuple[SymbolEntry, ...]:
+        """Resolve symbols by exact key, falling back to the suffix index.
+
+        Args:
+            symbols: Symbol names to find
+
+        Returns:
+            Tuple of matching symbol metadata
+        """
+        logger.debug("Querying symbols: %s", symbols)
+        all_results: list[SymbolEntry] = []
 
         for symbol in symbols:
             # Exact match
             if symbol in self.lookup_table:
                 matches = self.lookup_table[symbol]
-                logger.debug(f"Exact match for '{symbol}': {len(matches)} results")
+                logger.debug("Exact match for '%s': %d results", symbol, len(matches))
                 all_results.extend(matches)
                 continue
 
-            # Suffix matching for partial paths
-            matches = [
-                metadata
-                for key, metadata_list in self.lookup_table.items()
-                if key.endswith(f".{symbol}") or key == symbol
-                for metadata in metadata_list
-            ]
-
-            logger.debug(f"Suffix match for '{symbol}': {len(matches)} results")
+            # Suffix match for partial paths
+            matches = self.suffix_index.get(symbol, [])
+            logger.debug("Suffix match for '%s': %d results", symbol, len(matches))
             all_results.extend(matches)
 
-        logger.debug(f"Total results: {len(all_results)}")
-        return all_results
+        logger.debug("Total results: %d", len(all_results))
+        return tuple(all_results)
+
+    def get_code_chunk(self, metadata: SymbolEntry) -> str:
+        """Get the code chunk for a symbol.
 
-    def get_code_chunk(self, metadata: SymbolMetadata) -> str:
-        """Read code chunk from file.
+        Slices the source blob captured at build time, so files are not
+        reopened and a chunk always matches the indexed line numbers.
 
         Args:
-            metadata: Symbol metadata with file path and line numbers
+            metadata: Symbol entry with its byte range in the source blob
 
         Returns:
             Source code string
-
-        Raises:
-            FileNotFoundError: If file doesn't exist
-            ValueError: If line numbers are invalid
         """
-        file_path = Path(metadata.file_path)
-
-        logger.debug(f"Reading code from: {file_path}")
-        logger.debug(f"Lines {metadata.start_line}-{metadata.end_line}")
-
-        if not file_path.exists():
-            error_msg = f"File not found: {file_path}"
-            logger.error(error_msg)
-            raise FileNotFoundError(error_msg)
-
-        with file_path.open(encoding="utf-8") as f:
-            lines = f.readlines()
-
-        if metadata.start_line < 1:
-            raise ValueError(f"Invalid start_line: {metadata.start_line}")
-        if metadata.end_line > len(lines):
-            raise ValueError(
-                f"end_line {metadata.end_line} exceeds file length {len(lines)}"
-            )
-
-        code = "".join(lines[metadata.start_line - 1 : metadata.end_line])
-        logger.debug(f"Successfully read {len(code)} characters")
-        return code
+        end = metadata.source_offset + metadata.source_length
+        return self._source[metadata.source_offset : end].decode("utf-8")
@@ -1,56 +1,60 @@
 """Main entry point for the application."""
 
 import logging
-from logging.handlers import RotatingFileHandler
+import os
+from urllib.parse import urlparse
 
 import uvicorn
 from dotenv import load_dotenv
+from uvicorn.supervisors import Multiprocess
 
-from http_server import app
-from mcp_server import mcp_app
+from logging_config import setup_logging
+from server import Server
 
 load_dotenv()
 
-# Configure logging with rotation
-handlers = [
-    logging.StreamHandler(),  # Console output
-    RotatingFileHandler(
-        "app.log",
-        maxBytes=10 * 1024 * 1024,  # 10MB
-        backupCount=5,
-        encoding="utf-8",
-    ),
-]
-
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    handlers=handlers,
-)
-
-# Reduce verbosity of noisy loggers
-logging.getLogger("httpcore").setLevel(logging.WARNING)
-logging.getLogger("httpx").setLevel(logging.WARNING)
-logging.getLogger("mcp.client.sse").setLevel(logging.WARNING)
-logging.getLogger("mcp.server.sse").setLevel(logging.WARNING)
-
 logger = logging.getLogger(__name__)
 
-# Mount MCP server as sub-application
-app.mount("/mcp", mcp_app)
-logger.info("Mounted MCP server at /mcp")
-
 
 if __name__ == "__main__":
+    workers = int(os.getenv("WORKERS", "1"))
+    setup_logging()
+
     logger.info("=" * 60)
     logger.info("Starting Code Locator Agent API")
     logger.info("Main API: http://0.0.0.0:8001/query (POST)")
     logger.info("MCP SSE:  http://0.0.0.0:8001/mcp/sse")
+    logger.info(f"Workers:  {workers}")
     logger.info("=" * 60)
 
-    uvicorn.run(
-        app,
+    # MCP SSE sessions live in the memory of the worker that opened them, so
+    # with several workers the agent must use a standalone MCP server
+    mcp_url = os.getenv("MCP_SERVER_URL", "")
+    if workers > 1 and urlparse(mcp_url).path.startswith("/mcp/"):
+        logger.warning(
+            "MCP_SERVER_URL points at the mounted /mcp endpoint, which does not "
+            "work across workers; run mcp_server.py and point MCP_SERVER_URL at it"
+        )
+
+    # Only launch from here: spawned workers re-run this file as __mp_main__,
+    # so the app, its logging and the /mcp mount all live in server.py. This
+    # is uvicorn.run with server.Server, which closes the agent before
+    # draining. uvloop and httptools are picked up automatically where
+    # installed.
+    config = uvicorn.Config(
+        "server:app",
         host="0.0.0.0",
         port=8001,
+        workers=workers,
         log_level="info",
+        access_log=os.getenv("ACCESS_LOG", "false").lower() == "true",
     )
+    server = Server(config)
+    try:
+        if workers > 1:
+            sock = config.bind_socket()
+            Multiprocess(config, target=server.run, sockets=[sock]).run()
+        else:
+            server.run()
+    except KeyboardInterrupt:
+        pass  # uvicorn re-raises the Ctrl-C it handled once shutdown completes
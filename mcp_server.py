@@ -38,26 +38,24 @@ async def get_source_code(symbols: list[str]) -> SymbolLookupResult:
 
     try:
         metadata_results = await asyncio.to_thread(builder.query_symbols, symbols)
-        logger.debug(f"Found {len(metadata_results)} metadata results")
+        logger.debug("Found %d metadata results", len(metadata_results))
 
         if not metadata_results:
             error_msg = f"No code found for symbols: {', '.join(symbols)}"
             logger.warning(error_msg)
-            return SymbolLookupResult(matches=[], error=error_msg).model_dump()
+            return SymbolLookupResult(matches=[], error=error_msg)
 
         all_matches: list[SymbolMatch] = []
         for metadata in metadata_results:
-            logger.debug(f"Processing {metadata.name} from {metadata.file_path}")
+            logger.debug("Processing %s from %s", metadata.name, metadata.file_path)
 
+            # A slice of the in-memory source blob; cheaper than a thread hop
             try:
-                code_chunk = await asyncio.to_thread(builder.get_code_chunk, metadata)
+                code_chunk = builder.get_code_chunk(metadata)
 
                 if not code_chunk:
                     logger.warning(f"Empty code chunk for {metadata.name}")
 
-            except FileNotFoundError as e:
-                logger.error(f"File not found: {e}")
-                code_chunk = f"# ERROR: {e}"
             except Exception as chunk_err:
                 logger.exception(f"Failed to get code chunk: {chunk_err}")
                 code_chunk = f"# ERROR: {chunk_err}"
@@ -66,19 +64,18 @@ async def get_source_code(symbols: list[str]) -> SymbolLookupResult:
 
             try:
                 match = SymbolMatch(
-                    metadata=metadata, code=code_chunk, citation=citation
+                    metadata=metadata.to_metadata(), code=code_chunk, citation=citation
                 )
                 all_matches.append(match)
             except Exception as match_err:
                 logger.exception(f"Failed to create SymbolMatch: {match_err}")
 
         logger.info(f"Returning {len(all_matches)} matches for {len(symbols)} symbols")
-        result = SymbolLookupResult(matches=all_matches, error=None)
-        return result.model_dump()
+        return SymbolLookupResult(matches=all_matches, error=None)
 
     except Exception as e:
         logger.exception(f"Unexpected error: {e}")
-        return SymbolLookupResult(matches=[], error=str(e)).model_dump()
+        return SymbolLookupResult(matches=[], error=str(e))
 
 
 # Expose SSE app for mounting in FastAPI
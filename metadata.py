@@ -1,6 +1,8 @@
 """Pydantic models for code symbols and explanations."""
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field, field_validator
+
+from utils import MAX_QUERY_LENGTH, validate_query
 
 
 class SymbolMetadata(BaseModel):
@@ -17,6 +19,22 @@ class SymbolMetadata(BaseModel):
     source_code: str | None = None
 
 
+class QueryRequest(BaseModel):
+    """Code explanation request body."""
+
+    model_config = ConfigDict(str_strip_whitespace=True)
+
+    query: str = Field(
+        min_length=1, max_length=MAX_QUERY_LENGTH, description="User query"
+    )
+
+    @field_validator("query")
+    @classmethod
+    def check_query(cls, value: str) -> str:
+        """Apply the content checks, reported as validation errors."""
+        return validate_query(value)
+
+
 class CodeExplanation(BaseModel):
     """Structured code explanation returned to user."""
 
@@ -26,6 +44,13 @@ class CodeExplanation(BaseModel):
     key_concepts: list[str] = Field(description="Key concepts")
 
 
+class BatchAnswer(BaseModel):
+    """Answer to one numbered query of a batched agent run."""
+
+    index: int = Field(description="Number of the query being answered")
+    explanation: CodeExplanation
+
+
 class SymbolMatch(BaseModel):
     """Single symbol match with code and citation."""
 
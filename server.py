@@ -0,0 +1,47 @@
+"""ASGI application served by uvicorn: the HTTP API with MCP mounted at /mcp.
+
+uvicorn imports this module as server:app, once in each worker process, so
+logging setup and the mount happen exactly once per process.
+"""
+
+import logging
+import socket
+
+import uvicorn
+from sse_starlette.sse import AppStatus
+
+from http_server import app
+from logging_config import setup_logging
+from mcp_server import mcp_app
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+# Mount MCP server as sub-application
+app.mount("/mcp", mcp_app)
+logger.info("Mounted MCP server at /mcp")
+
+
+class Server(uvicorn.Server):
+    """uvicorn server that closes the agent before draining connections.
+
+    The agent keeps an MCP session open over SSE, by default to the /mcp
+    mount of this same server. uvicorn drains connections before the lifespan
+    shutdown, and sse_starlette (used by the MCP transport) cuts every event
+    stream as soon as shutdown starts, so the session was torn down mid-stream
+    and both ends logged errors. Here the agent is closed first, and only then
+    are the remaining event streams released.
+    """
+
+    async def startup(self, sockets: list[socket.socket] | None = None) -> None:
+        """Take over ending event streams from sse_starlette, then start."""
+        AppStatus.disable_automatic_graceful_drain()
+        await super().startup(sockets)
+
+    async def shutdown(self, sockets: list[socket.socket] | None = None) -> None:
+        """Close the agent, release event streams, then drain as usual."""
+        agent = getattr(app.state, "agent_instance", None)
+        if agent is not None:
+            await agent.close()
+        AppStatus.should_exit = True
+        await super().shutdown(sockets)
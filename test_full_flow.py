@@ -6,16 +6,18 @@ Tests the core functionality without starting HTTP/MCP servers:
 - Symbol indexing (AST parsing)
 - Symbol lookup queries
 - MCP tool execution
+- Query batching and response caching, with the agent runs stubbed out
 """
 
 import asyncio
 import logging
 import os
-from pathlib import Path
 
 from dotenv import load_dotenv
 
+from agent import BatchScheduler, CodeLocatorAgent, LLMCache
 from lookup import LookupBuilder
+from metadata import BatchAnswer, CodeExplanation, SymbolLookupResult
 
 # Configure logging
 logging.basicConfig(
@@ -26,6 +28,15 @@ logger = logging.getLogger(__name__)
 
 load_dotenv()
 
+SEP = "=" * 60
+SUBSEP = "-" * 60
+
+TEST_QUERIES = (
+    "Client.get",
+    "AsyncClient.get",
+    "AsyncHTTPTransport.handle_async_request",
+)
+
 
 def check_environment() -> bool:
     """Verify required environment variables are set.
@@ -33,25 +44,26 @@ def check_environment() -> bool:
     Returns:
         True if all required vars present, False otherwise
     """
-    logger.info("=" * 60)
-    logger.info("ENVIRONMENT CHECK")
-    logger.info("=" * 60)
+    logger.info("\n".join([SEP, "ENVIRONMENT CHECK", SEP]))
 
     openai_key = os.getenv("OPENAI_API_KEY")
     mcp_url = os.getenv("MCP_SERVER_URL")
     httpx_dir = os.getenv("HTTPX_SOURCE_DIR", "./httpx/httpx")
 
-    logger.info(f"OPENAI_API_KEY: {'✓ Set' if openai_key else '✗ NOT SET'}")
-    logger.info(f"MCP_SERVER_URL: {mcp_url or '✗ NOT SET'}")
-    logger.info(f"HTTPX_SOURCE_DIR: {httpx_dir}")
+    logger.info(
+        f"OPENAI_API_KEY: {'✓ Set' if openai_key else '✗ NOT SET'}\n"
+        f"MCP_SERVER_URL: {mcp_url or '✗ NOT SET'}\n"
+        f"HTTPX_SOURCE_DIR: {httpx_dir}"
+    )
 
     # Check if httpx directory exists
-    httpx_path = Path(httpx_dir)
-    if httpx_path.exists():
+    if os.path.exists(httpx_dir):
         logger.info(f"✓ httpx directory found at {httpx_dir}")
     else:
-        logger.error(f"✗ httpx directory not found at {httpx_dir}")
-        logger.error("  Clone it: git clone https://github.com/encode/httpx.git")
+        logger.error(
+            f"✗ httpx directory not found at {httpx_dir}\n"
+            "  Clone it: git clone https://github.com/encode/httpx.git"
+        )
         return False
 
     return True
@@ -63,10 +75,7 @@ def test_lookup_builder() -> LookupBuilder | None:
     Returns:
         LookupBuilder instance if successful, None otherwise
     """
-    logger.info("")
-    logger.info("=" * 60)
-    logger.info("TESTING LOOKUP BUILDER")
-    logger.info("=" * 60)
+    logger.info("\n".join(["", SEP, "TESTING LOOKUP BUILDER", SEP]))
 
     try:
         builder = LookupBuilder()
@@ -84,25 +93,23 @@ def test_symbol_queries(builder: LookupBuilder) -> None:
     Args:
         builder: Initialized LookupBuilder instance
     """
-    logger.info("")
-    logger.info("TESTING SYMBOL QUERIES")
-    logger.info("-" * 60)
+    logger.info("\n".join(["", "TESTING SYMBOL QUERIES", SUBSEP]))
 
-    test_queries = [
-        "Client.get",
-        "AsyncClient.get",
-        "AsyncHTTPTransport.handle_async_request",
-    ]
+    if not builder.lookup_table:
+        logger.warning("✗ Lookup table is empty, skipping symbol queries")
+        return
 
-    for query in test_queries:
+    for query in TEST_QUERIES:
         results = builder.query_symbols([query])
         if results:
-            logger.info(f"✓ {query}: Found {len(results)} result(s)")
+            logger.info("✓ %s: Found %d result(s)", query, len(results))
             for result in results:
-                filename = Path(result.file_path).name
-                logger.info(f"    {filename}:{result.start_line}-{result.end_line}")
+                filename = os.path.basename(result.file_path)
+                logger.info(
+                    "    %s:%d-%d", filename, result.start_line, result.end_line
+                )
         else:
-            logger.warning(f"✗ {query}: NOT FOUND")
+            logger.warning("✗ %s: NOT FOUND", query)
 
 
 async def test_mcp_tool() -> bool:
@@ -111,34 +118,35 @@ async def test_mcp_tool() -> bool:
     Returns:
         True if test passed, False otherwise
     """
-    logger.info("")
-    logger.info("=" * 60)
-    logger.info("TESTING MCP TOOL")
-    logger.info("=" * 60)
+    logger.info("\n".join(["", SEP, "TESTING MCP TOOL", SEP]))
 
     try:
+        # Deferred: importing mcp_server builds its own lookup table, which
+        # must not happen before check_environment has run
         from mcp_server import get_source_code
 
         result = await get_source_code(["Client.get"])
 
-        if not isinstance(result, dict):
+        if not isinstance(result, SymbolLookupResult):
             logger.error(f"✗ Unexpected result type: {type(result)}")
             return False
 
-        matches = result.get("matches", [])
-        error = result.get("error")
+        matches = result.matches
+        error = result.error
 
         if error:
             logger.error(f"✗ Tool returned error: {error}")
             return False
 
-        logger.info("✓ MCP tool executed successfully")
-        logger.info(f"  Matches found: {len(matches)}")
-
+        lines = [
+            "✓ MCP tool executed successfully",
+            f"  Matches found: {len(matches)}",
+        ]
         if matches:
             first_match = matches[0]
-            logger.info(f"  Symbol: {first_match['metadata']['name']}")
-            logger.info(f"  Code length: {len(first_match.get('code', ''))} chars")
+            lines.append(f"  Symbol: {first_match.metadata.name}")
+            lines.append(f"  Code length: {len(first_match.code)} chars")
+        logger.info("\n".join(lines))
 
         return True
 
@@ -147,10 +155,194 @@ async def test_mcp_tool() -> bool:
         return False
 
 
+def _explanation(text: str) -> CodeExplanation:
+    """Build a minimal CodeExplanation for the stubbed agent runs."""
+    return CodeExplanation(
+        symbols=[], explanation=text, file_locations=[], key_concepts=[]
+    )
+
+
+async def test_batch_scheduler() -> bool:
+    """Test batching and shutdown of BatchScheduler with a stub run_batch.
+
+    Returns:
+        True if test passed, False otherwise
+    """
+    logger.info("\n".join(["", SEP, "TESTING BATCH SCHEDULER", SEP]))
+
+    batches: list[list[str]] = []
+    release = asyncio.Event()
+
+    async def run_batch(queries: list[str]) -> list[CodeExplanation]:
+        batches.append(queries)
+        await release.wait()
+        return [_explanation(f"answer to {query}") for query in queries]
+
+    scheduler = BatchScheduler(run_batch, max_batch_size=2, max_wait_ms=50)
+    try:
+        # Two queries fill the first batch, the third waits in a second one
+        tasks = [
+            asyncio.create_task(scheduler.submit(query)) for query in ("a", "b", "c")
+        ]
+        await asyncio.sleep(0.01)
+        release.set()
+        results = await asyncio.gather(*tasks)
+
+        if batches[0] != ["a", "b"] or [r.explanation for r in results] != [
+            "answer to a",
+            "answer to b",
+            "answer to c",
+        ]:
+            logger.error(f"✗ Unexpected batching: {batches}")
+            return False
+        logger.info(f"✓ Batched queries as {batches}")
+
+        # A query still waiting for its batch to fill must fail on stop()
+        queued = asyncio.create_task(scheduler.submit("d"))
+        await asyncio.sleep(0)
+        await scheduler.stop()
+        try:
+            async with asyncio.timeout(1):
+                await queued
+            logger.error("✗ Queued query completed after stop()")
+            return False
+        except TimeoutError:
+            logger.error("✗ Queued query still pending after stop()")
+            return False
+        except RuntimeError:
+            logger.info("✓ stop() failed the queued query")
+
+        try:
+            await scheduler.submit("e")
+            logger.error("✗ submit() accepted a query after stop()")
+            return False
+        except RuntimeError:
+            logger.info("✓ submit() rejected after stop()")
+
+        return True
+
+    except Exception as e:
+        logger.exception(f"✗ Batch scheduler test failed: {e}")
+        return False
+
+    finally:
+        await scheduler.stop()
+
+
+async def test_batch_matching() -> bool:
+    """Test that batched answers are matched to queries by index.
+
+    The agent runs are stubbed, so no model or MCP server is contacted.
+
+    Returns:
+        True if test passed, False otherwise
+    """
+    logger.info("\n".join(["", "TESTING BATCH ANSWER MATCHING", SUBSEP]))
+
+    # Only the attributes _run_batch touches; the real constructor builds
+    # model clients that need an API key
+    agent = CodeLocatorAgent.__new__(CodeLocatorAgent)
+    agent.agent, agent.batch_agent = "single", "batch"
+    batch_indices: list[int] = []
+
+    async def ensure_session() -> None:
+        pass
+
+    async def run_agent(which: str, prompt: str) -> object:
+        if which == "single":
+            return _explanation(f"single {prompt}")
+        return [
+            BatchAnswer(index=i, explanation=_explanation(f"batch {i}"))
+            for i in batch_indices
+        ]
+
+    agent._ensure_session = ensure_session
+    agent._run_agent = run_agent
+    queries = ["q1", "q2", "q3"]
+
+    try:
+        cases = (
+            ("answers out of order", [3, 1, 2], ["batch 1", "batch 2", "batch 3"]),
+            ("missing index", [1, 3], ["single q1", "single q2", "single q3"]),
+            ("duplicate index", [1, 1, 2, 3], ["single q1", "single q2", "single q3"]),
+        )
+        for name, indices, expected in cases:
+            batch_indices[:] = indices
+            results = await agent._run_batch(queries)
+            got = [result.explanation for result in results]
+            if got != expected:
+                logger.error(f"✗ {name}: expected {expected}, got {got}")
+                return False
+            logger.info(f"✓ {name}: {got}")
+
+        return True
+
+    except Exception as e:
+        logger.exception(f"✗ Batch matching test failed: {e}")
+        return False
+
+
+async def test_llm_cache() -> bool:
+    """Test LLMCache single-flight deduplication and failure handling.
+
+    Returns:
+        True if test passed, False otherwise
+    """
+    logger.info("\n".join(["", "TESTING RESPONSE CACHE", SUBSEP]))
+
+    cache = LLMCache(ttl=60, max_entries=8)
+    calls = 0
+    fail = False
+
+    async def compute() -> CodeExplanation:
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        if fail:
+            raise RuntimeError("model unavailable")
+        return _explanation(f"run {calls}")
+
+    try:
+        # Identical concurrent queries, up to whitespace, share one run
+        results = await asyncio.gather(
+            *(cache.get_or_compute(q, compute) for q in ("Client.get", " Client.get "))
+        )
+        if calls != 1 or {result.explanation for result in results} != {"run 1"}:
+            logger.error(f"✗ Concurrent queries ran {calls} times")
+            return False
+        logger.info("✓ Concurrent identical queries computed once")
+
+        if (await cache.get_or_compute("Client.get", compute)).explanation != "run 1":
+            logger.error("✗ Repeated query was not served from the cache")
+            return False
+        logger.info("✓ Repeated query served from the cache")
+
+        # A failure reaches every waiting caller but is not cached
+        fail = True
+        results = await asyncio.gather(
+            *(cache.get_or_compute("Client.post", compute) for _ in range(2)),
+            return_exceptions=True,
+        )
+        if calls != 2 or not all(isinstance(r, RuntimeError) for r in results):
+            logger.error(f"✗ Unexpected failure handling: {results}")
+            return False
+
+        fail = False
+        if (await cache.get_or_compute("Client.post", compute)).explanation != "run 3":
+            logger.error("✗ Failed query was cached")
+            return False
+        logger.info("✓ Failures are shared but not cached")
+
+        return True
+
+    except Exception as e:
+        logger.exception(f"✗ Response cache test failed: {e}")
+        return False
+
+
 def main() -> None:
     """Run all integration tests."""
-    logger.info("Starting integration tests...")
-    logger.info("")
+    logger.info("Starting integration tests...\n")
 
     # Environment check
     if not check_environment():
@@ -166,23 +358,34 @@ def main() -> None:
     # Symbol query tests
     test_symbol_queries(builder)
 
-    # MCP tool test
-    mcp_success = asyncio.run(test_mcp_tool())
+    # MCP tool, batching and cache tests; async tests share one event loop
+    with asyncio.Runner() as runner:
+        mcp_success = runner.run(test_mcp_tool())
+        batch_success = runner.run(test_batch_scheduler())
+        matching_success = runner.run(test_batch_matching())
+        cache_success = runner.run(test_llm_cache())
 
     # Summary
-    logger.info("")
-    logger.info("=" * 60)
-    if mcp_success:
-        logger.info("✓ ALL TESTS PASSED")
-        logger.info("")
-        logger.info("To test the full application:")
-        logger.info("  1. Start server: python main.py")
-        logger.info("  2. Query API:")
-        logger.info("     curl -X POST http://localhost:8001/query \\")
-        logger.info("          -d 'Explain Client.get'")
+    if all((mcp_success, batch_success, matching_success, cache_success)):
+        logger.info(
+            "\n".join(
+                [
+                    "",
+                    SEP,
+                    "✓ ALL TESTS PASSED",
+                    "",
+                    "To test the full application:",
+                    "  1. Start server: python main.py",
+                    "  2. Query API:",
+                    "     curl -X POST http://localhost:8001/query \\",
+                    "          -H 'Content-Type: application/json' \\",
+                    "          -d '{\"query\": \"Explain Client.get\"}'",
+                    SEP,
+                ]
+            )
+        )
     else:
-        logger.warning("⚠ Some tests failed")
-    logger.info("=" * 60)
+        logger.warning("\n".join(["", SEP, "⚠ Some tests failed", SEP]))
 
 
 if __name__ == "__main__":
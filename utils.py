@@ -1,27 +1,67 @@
-"""Input validation utilities for API endpoints."""
+"""Input validation utilities for API endpoints.
 
+Checks raise ValueError, so they can run inside Pydantic validators.
+"""
+
+import functools
 import re
-from fastapi import HTTPException
 
 MAX_QUERY_LENGTH = 300
 
-FORBIDDEN_PATTERNS = {
-    "ignore previous",
-    "disregard",
-    "forget",
-    "instead",
-    "new instructions",
-    "system:",
-    "assistant:",
-    "you are now",
-    "act as",
-    "pretend",
-    "roleplay",
-}
+# Accepted queries remembered by the content checks; rejections raise and are
+# never cached
+VALIDATION_CACHE_SIZE = 1024
+
+FORBIDDEN_PATTERNS = frozenset(
+    {
+        "ignore previous",
+        "disregard",
+        "forget",
+        "instead",
+        "new instructions",
+        "system:",
+        "assistant:",
+        "you are now",
+        "act as",
+        "pretend",
+        "roleplay",
+    }
+)
+
+# Matched against the lowercased query; lowering once is cheaper than
+# re.IGNORECASE, which slows the engine's literal scan several times over
+_PATH_RE = re.compile(r"\.\.|/etc/|~/|file://")
+
+
+@functools.lru_cache(maxsize=VALIDATION_CACHE_SIZE)
+def _check_content(text: str) -> None:
+    """Reject path traversal and prompt injection attempts.
+
+    Memoized, since clients tend to send the same queries again.
+
+    Args:
+        text: User query string
+
+    Raises:
+        ValueError: If query content is not allowed
+    """
+    # Every path pattern contains ".." or "/", so most queries skip the regex
+    lower_text = text.lower()
+    if (".." in lower_text or "/" in lower_text) and _PATH_RE.search(lower_text):
+        raise ValueError("Invalid characters detected.")
+
+    # Plain substring checks: CPython's str search outruns a regex alternation
+    # of these phrases for anything longer than a few words, and an
+    # Aho-Corasick automaton saves under a microsecond at best
+    if any(pattern in lower_text for pattern in FORBIDDEN_PATTERNS):
+        raise ValueError("Invalid query content detected.")
 
 
 def validate_query(text: str) -> str:
     """Validate user query for security and format.
+
+    Length is not checked here: QueryRequest enforces MAX_QUERY_LENGTH with
+    max_length before this runs.
     
     Args:
         text: User query string
@@ -30,25 +70,8 @@ def validate_query(text: str) -> str:
         Validated query string
         
     Raises:
-        HTTPException: If query fails validation
+        ValueError: If query fails validation
     """
-    if len(text) > MAX_QUERY_LENGTH:
-        raise HTTPException(
-            status_code=400,
-            detail=f"Query too long. Max {MAX_QUERY_LENGTH} characters.",
-        )
-
-    if re.search(r'\.\.|/etc/|~/|file://', text.lower()):
-        raise HTTPException(
-            status_code=400,
-            detail="Invalid characters detected.",
-        )
-
-    lower_text = text.lower()
-    if any(pattern in lower_text for pattern in FORBIDDEN_PATTERNS):
-        raise HTTPException(
-            status_code=400,
-            detail="Invalid query content detected.",
-        )
+    _check_content(text)
 
     return text